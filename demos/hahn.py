@@ -82,27 +82,29 @@ class HahnEcho(QickCode):
                 name='-pi/2',
             )
 
-            pi2_pi_pi2 = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                pos_pi2_pulse + \
-                Delay(length=tau_reg, name='tau 1') + \
-                pi_pulse + \
-                Delay(length=tau_reg, name='tau 2') + \
-                pos_pi2_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
-
-            pi2_pi_mpi2 = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                pos_pi2_pulse + \
-                Delay(length=tau_reg, name='tau 1') + \
-                pi_pulse + \
-                Delay(length=tau_reg, name='tau 2') + \
-                neg_pi2_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            pi2_pi_pi2 = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                pos_pi2_pulse,
+                Delay(length=tau_reg, name='tau 1'),
+                pi_pulse,
+                Delay(length=tau_reg, name='tau 2'),
+                pos_pi2_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
+
+            pi2_pi_mpi2 = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                pos_pi2_pulse,
+                Delay(length=tau_reg, name='tau 1'),
+                pi_pulse,
+                Delay(length=tau_reg, name='tau 2'),
+                neg_pi2_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
             tau_sweep = QickSweep(
                 code=pi2_pi_pi2 + pi2_pi_mpi2,
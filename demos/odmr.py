@@ -55,19 +55,21 @@ class PulsedODMR(QickCode):
                 step=QickFreq(freq_step, gen_ch=dac_channels['sample'])
             )
 
-            mw_on = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                RFPulse(ch=dac_channels['sample'], length=mw_len, freq=freq_reg, amp=amp) + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            mw_on = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                RFPulse(ch=dac_channels['sample'], length=mw_len, freq=freq_reg, amp=amp),
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
-            mw_off = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                Delay(length=mw_len, name='mw_delay') + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            mw_off = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                Delay(length=mw_len, name='mw_delay'),
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
             experiment = mw_on + mw_off
 
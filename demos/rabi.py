@@ -64,19 +64,21 @@ class Rabi(QickCode):
                 name='mw',
             )
 
-            w_mw = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                mw_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            w_mw = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                mw_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
-            no_mw = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                Delay(length=mw_reg, name='no mw') + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            no_mw = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                Delay(length=mw_reg, name='no mw'),
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
             mw_sweep = QickSweep(
                 code=w_mw + no_mw,
@@ -82,23 +82,25 @@ class Ramsey(QickCode):
                 name='-pi/2',
             )
 
-            pi2_pi2 = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                pos_pi2_pulse + \
-                Delay(length=tau_reg, name='tau') + \
-                pos_pi2_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
-
-            pi2_mpi2 = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                pos_pi2_pulse + \
-                Delay(length=tau_reg, name='tau') + \
-                neg_pi2_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            pi2_pi2 = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                pos_pi2_pulse,
+                Delay(length=tau_reg, name='tau'),
+                pos_pi2_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
+
+            pi2_mpi2 = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                pos_pi2_pulse,
+                Delay(length=tau_reg, name='tau'),
+                neg_pi2_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
             tau_sweep = QickSweep(
                 code=pi2_pi2 + pi2_mpi2,
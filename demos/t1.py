@@ -66,21 +66,23 @@ class T1(QickCode):
                 name='pi',
             )
 
-            pi = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                Delay(length=tau_reg, name='tau 1') + \
-                pi_pulse + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            pi = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                Delay(length=tau_reg, name='tau 1'),
+                pi_pulse,
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
-            no_pi = \
-                init + \
-                Delay(length=mw_pre_padding, name='mw_pre_padding') + \
-                Delay(length=tau_reg, name='tau_1') + \
-                Delay(length=pi_time, name='pi_delay') + \
-                Delay(length=mw_post_padding, name='mw_post_padding') + \
-                readout
+            no_pi = QickCode.concat(
+                init,
+                Delay(length=mw_pre_padding, name='mw_pre_padding'),
+                Delay(length=tau_reg, name='tau_1'),
+                Delay(length=pi_time, name='pi_delay'),
+                Delay(length=mw_post_padding, name='mw_post_padding'),
+                readout,
+            )
 
             tau_sweep = QickSweep(
                 code=pi + no_pi,
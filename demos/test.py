@@ -5,7 +5,7 @@ from qpc.board import qick_spin_4x2
 from qpc.io import QickIO, QickIODevice
 from qpc.loop import QickLoop, QickSweep
 from qpc.pulse import Delay, TrigConst, TrigPulse, RFPulse
-from qpc.type import QickCode, QickScope, QickReg, QickSweptReg, QickTime
+from qpc.type import QickAssignment, QickCode, QickScope, QickReg, QickSweptReg, QickTime
 
 pmod0_0 = QickIO(channel_type='trig', channel='PMOD0_0', offset=0)
 pmod0_1 = QickIO(channel_type='trig', channel='PMOD0_1', offset=0)
@@ -212,6 +212,53 @@ def test21():
         r2.assign(exp)
     return code
 
+def test22():
+    code = QickCode(name='code')
+    with QickScope(code):
+        r0 = QickReg(val=QickTime(1e-6, gen_ch=0))
+        r1 = QickReg(val=QickTime(2e-6, gen_ch=0))
+        r2 = QickReg()
+        # channel-less constant added to an expression of channel-bound regs
+        r2.assign((r0 + r1) + QickTime(3e-6))
+        code.trig(ch=0, state=True, time=r0 + r1)
+    return code
+
+def check_concat(qpc: QPC):
+    def pulses():
+        return (
+            TrigPulse(ch=0, length=1e-6, name='t1'),
+            Delay(length=2e-6, name='d1'),
+            TrigPulse(ch=1, length=3e-6, name='t2'),
+            RFPulse(ch=0, length=1e-6, freq=100e6, amp=10_000, name='rf1'),
+        )
+
+    def instructions(code: QickCode):
+        # chaining + and | nests the code blocks, which only adds comments
+        asm = qpc.qpc_compile(code)
+        return [line for line in asm.splitlines() if not line.startswith('//')]
+
+    a, b, c, d = pulses()
+    assert instructions(QickCode.concat(*pulses())) == instructions(a + b + c + d)
+    a, b, c, d = pulses()
+    assert instructions(QickCode.parallel_all(*pulses())) == instructions(a | b | c | d)
+
+def check_copy_shares_qick_type():
+    code = QickCode(name='code')
+    with QickScope(code):
+        time = QickTime(1e-6)
+        reg = QickReg()
+        reg.assign(time)
+
+    outer = QickCode(name='outer')
+    with QickScope(outer):
+        copied = code.qick_copy()
+    assignments = [v for v in copied.kvp.values() if isinstance(v, QickAssignment)]
+    assert assignments
+    for asn in assignments:
+        # the constant is copied, but its channel-less QickType is shared
+        assert asn.rhs is not time
+        assert asn.rhs._qick_type is type(asn.rhs)._no_ch_qick_type
+
 if __name__ == '__main__':
     with QPC(iomap=qick_spin_4x2, fake_soc=False) as qpc:
         qpc.run(test8())
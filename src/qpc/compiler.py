@@ -10,6 +10,7 @@ Date: 2024-08-16
 
 from __future__ import annotations
 import logging
+import re
 from math import ceil, log10
 from numbers import Number
 from pathlib import Path
@@ -34,12 +35,80 @@ else:
 from qick.tprocv2_assembler import Assembler
 
 from qpc.type import QickType, QickConstType, QickInt, QickLabel, QickTime
-from qpc.type import QickFreq, QickPhase, QickReg, QickExpression
-from qpc.type import QickAssignment, QickScope, QickCode
+from qpc.type import QickFreq, QickPhase, QickReg, QickSweptReg, QickExpression
+from qpc.type import QickAssignment, QickScope, QickCode, _key_re
 from qpc.io import QickIO, QickIODevice
 
 _logger = logging.getLogger(__name__)
 
+def _imm_assignment_asm(asn: QickAssignment) -> str:
+    """Assembly code for assigning an immediate value to a register."""
+    return f'REG_WR {asn.reg} imm #{asn.rhs}\n'
+
+def _reg_assignment_asm(asn: QickAssignment) -> str:
+    """Assembly code for copying a register into a register."""
+    return f'REG_WR {asn.reg} op -op({asn.rhs})\n'
+
+def _exp_assignment_asm(asn: QickAssignment) -> str:
+    """Assembly code for assigning an expression to a register."""
+    return f'{asn.rhs.pre_asm_key()}REG_WR {asn.reg} op -op({asn.rhs.exp_asm_key()})\n'
+
+# separator line of the name header and footer comments
+_comment_rule = '// ---------------\n'
+
+# matches the keys of the compiled QickExpression parts in the assembly code,
+# e.g. *12345*pre_asm
+_exp_key_re = re.compile(r'\*\d+\*(?:pre|exp)_asm')
+
+def _sub_keys(key_re: re.Pattern, values: Dict[str, str], asm: str) -> str:
+    """Replace the keys in the assembly code with their values in a single
+    pass.
+
+    Args:
+        key_re: Pattern matching the keys.
+        values: Keys are the keys to replace, values are their replacements.
+            Matched keys that are not in values are left unchanged.
+        asm: Assembly code.
+
+    """
+    if not values:
+        return asm
+    return key_re.sub(lambda m: values.get(m.group(0), m.group(0)), asm)
+
+# functions that generate the assembly code of a QickAssignment, keys are
+# the type of the right-hand-side of the assignment, other subclasses are
+# added by _resolve_assignment_asm() the first time they are seen
+_assignment_asm = {
+    int: _imm_assignment_asm,
+    QickInt: _imm_assignment_asm,
+    QickTime: _imm_assignment_asm,
+    QickFreq: _imm_assignment_asm,
+    QickPhase: _imm_assignment_asm,
+    QickReg: _reg_assignment_asm,
+    QickSweptReg: _reg_assignment_asm,
+    QickExpression: _exp_assignment_asm,
+}
+
+def _resolve_assignment_asm(rhs_type: type):
+    """Find the function that generates the assembly code of a
+    QickAssignment and cache it in _assignment_asm.
+
+    Args:
+        rhs_type: Type of the right-hand-side of the assignment.
+
+    """
+    if issubclass(rhs_type, int) or issubclass(rhs_type, QickConstType):
+        assignment_asm = _imm_assignment_asm
+    elif issubclass(rhs_type, QickReg):
+        assignment_asm = _reg_assignment_asm
+    elif issubclass(rhs_type, QickExpression):
+        assignment_asm = _exp_assignment_asm
+    else:
+        raise TypeError(f'Tried to assign reg a value with an invalid type.')
+
+    _assignment_asm[rhs_type] = assignment_asm
+    return assignment_asm
+
 # dummy classes to simulate the soc object
 class FakeTProc:
     def __getattr__(self, attr):
@@ -102,6 +171,18 @@ class QPC(QickProgramV2):
         self.prog_done_flag_dmem_addr = prog_done_flag_dmem_addr
         self.soc_kwargs = soc_kwargs
 
+        # port name substitutions, which depend only on the iomap
+        self._port_nums = {}
+        for port_type in self.iomap.mappings:
+            for port_name, port in self.iomap.mappings[port_type].items():
+                # port name is a string, e.g. "PMOD0_0"
+                # port is one of the namedtuple types from io.py
+                self._port_nums.setdefault(f'*{port_name}*', str(port.port))
+        if self._port_nums:
+            self._port_re = re.compile('|'.join(re.escape(k) for k in self._port_nums))
+        else:
+            self._port_re = None
+
         if self.fake_soc:
             self.soc = FakeSoC()
             self.soccfg = None
@@ -136,16 +217,12 @@ class QPC(QickProgramV2):
         # if (w_length > 65535):
         #     raise ValueError('Waveform longer than 16 bits', w_length)
 
-        if isinstance(asn.rhs, int) or isinstance(asn.rhs, QickConstType):
-            asm = f'REG_WR {asn.reg} imm #{asn.rhs}\n'
-        elif isinstance(asn.rhs, QickReg):
-            asm = f'REG_WR {asn.reg} op -op({asn.rhs})\n'
-        elif isinstance(asn.rhs, QickExpression):
-            asm = f'{asn.rhs.pre_asm_key()}REG_WR {asn.reg} op -op({asn.rhs.exp_asm_key()})\n'
-        else:
-            raise TypeError(f'Tried to assign reg a value with an invalid type.')
+        rhs_type = type(asn.rhs)
+        assignment_asm = _assignment_asm.get(rhs_type)
+        if assignment_asm is None:
+            assignment_asm = _resolve_assignment_asm(rhs_type)
 
-        return asm
+        return assignment_asm(asn)
 
     def _qpc_compile_exp(
             self,
@@ -159,12 +236,73 @@ class QPC(QickProgramV2):
             regno: Number of lowest unused register.
 
         """
-        # series of REG_WR instructions that go before this expression
-        # to prepare the operands
-        pre_asm = ''
-        # assembly code of this expression, e.g. 'r1 + 5' or 'r1 + r2'
-        exp_asm = ''
+        # the expression tree is walked with an explicit stack instead of
+        # recursion so that deeply nested expressions don't hit the recursion
+        # limit, each frame is [left, right, operator, regno, pre_asm, exp_asm,
+        # stage] where pre_asm is the series of REG_WR instructions that go
+        # before this expression to prepare the operands, exp_asm is the
+        # assembly code of this expression, e.g. 'r1 + 5' or 'r1 + r2', and
+        # stage is 0 before the left operand, 1 before the right operand,
+        # and 2 when finished
+        stack = [self._qpc_compile_exp_frame(exp=exp, regno=regno)]
+        # (pre_asm, exp_asm) of the last finished sub-expression
+        sub_result = None
+
+        while True:
+            frame = stack[-1]
+            left, right, operator, regno, pre_asm, exp_asm, stage = frame
+
+            if stage == 0:
+                if sub_result is None and isinstance(left, QickExpression):
+                    # compile the left sub-expression first
+                    stack.append(self._qpc_compile_exp_frame(exp=left, regno=regno + 1))
+                    continue
+                if sub_result is not None:
+                    left_pre_asm, left_exp_asm = sub_result
+                    sub_result = None
+                    pre_asm += left_pre_asm
+                    pre_asm += f'REG_WR r{regno} op -op({left_exp_asm})\n'
+                    exp_asm += f'r{regno} '
+                    regno += 1
+                elif isinstance(left, QickReg):
+                    exp_asm += f'{left} '
+                else:
+                    exp_asm += f'#{left} '
+
+                exp_asm += operator
+                frame[3:7] = [regno, pre_asm, exp_asm, 1]
+                stage = 1
+
+            if stage == 1:
+                if sub_result is None and isinstance(right, QickExpression):
+                    # compile the right sub-expression first
+                    stack.append(self._qpc_compile_exp_frame(exp=right, regno=regno + 1))
+                    continue
+                if sub_result is not None:
+                    right_pre_asm, right_exp_asm = sub_result
+                    pre_asm += right_pre_asm
+                    pre_asm += f'REG_WR r{regno} op -op({right_exp_asm})\n'
+                    exp_asm += f' r{regno}'
+                elif isinstance(right, QickReg):
+                    exp_asm += f' {right}'
+                else:
+                    exp_asm += f' #{right}'
+
+            # this expression is finished, pass the result to its parent
+            stack.pop()
+            sub_result = (pre_asm, exp_asm)
+            if not stack:
+                return sub_result
+
+    def _qpc_compile_exp_frame(self, exp: QickExpression, regno: int) -> list:
+        """Create the stack frame used by _qpc_compile_exp() to compile a
+        QickExpression.
+
+        Args:
+            exp: Expression to compile.
+            regno: Number of lowest unused register.
 
+        """
         # TODO check that regno does not exceed # of registers
 
         if exp.operator == '*':
@@ -182,30 +320,7 @@ class QPC(QickProgramV2):
             left = exp.left
             right = exp.right
 
-        if isinstance(left, QickExpression):
-            left_pre_asm, left_exp_asm = self._qpc_compile_exp(exp=left, regno=regno + 1)
-            pre_asm += left_pre_asm
-            pre_asm += f'REG_WR r{regno} op -op({left_exp_asm})\n'
-            exp_asm += f'r{regno} '
-            regno += 1
-        elif isinstance(left, QickReg):
-            exp_asm += f'{left} '
-        else:
-            exp_asm += f'#{left} '
-
-        exp_asm += exp.operator
-
-        if isinstance(right, QickExpression):
-            right_pre_asm, right_exp_asm = self._qpc_compile_exp(exp=right, regno=regno + 1)
-            pre_asm += right_pre_asm
-            pre_asm += f'REG_WR r{regno} op -op({right_exp_asm})\n'
-            exp_asm += f' r{regno}'
-        elif isinstance(right, QickReg):
-            exp_asm += f' {right}'
-        else:
-            exp_asm += f' #{right}'
-
-        return pre_asm, exp_asm
+        return [left, right, exp.operator, regno, '', '', 0]
 
     def _qpc_compile(self, code: QickCode, regno: int, labelno: int):
         """Compile the assembly code. All special *key* in the assembly code
@@ -225,16 +340,14 @@ class QPC(QickProgramV2):
         if code.soc is None:
             code.soc = self.soc
 
-        # add name header
-        if code.name is not None:
-            asm = f'// ---------------\n// {code.name}\n// ---------------\n' + asm
-
         # compile QickAssignment (register assignments)
         with QickScope(code=code):
-            for key, qick_obj in code.kvp.copy().items():
-                if isinstance(qick_obj, QickAssignment):
-                    assignment_asm = self._qpc_compile_assignment(asn=qick_obj)
-                    asm = asm.replace(key, assignment_asm)
+            # collect the assignments first since compiling them adds to kvp
+            assignments = [(k, v) for k, v in code.kvp.items()
+                if isinstance(v, QickAssignment)]
+            assignments_asm = {key: self._qpc_compile_assignment(asn=qick_obj)
+                for key, qick_obj in assignments}
+        asm = _sub_keys(_key_re, assignments_asm, asm)
 
         # calculate how many registers will be allocated
         nregs = 0
@@ -243,48 +356,60 @@ class QPC(QickProgramV2):
                 nregs += 1
 
         # recursively compile the rest of the QickCode objects
-        for key, qick_obj in code.kvp.copy().items():
-            if isinstance(qick_obj, QickCode):
-                sub_asm, labelno = self._qpc_compile(code=qick_obj, regno=regno + nregs, labelno=labelno)
-                asm = asm.replace(key, sub_asm)
+        sub_codes = [(k, v) for k, v in code.kvp.items()
+            if isinstance(v, QickCode)]
+        sub_codes_asm = {}
+        for key, qick_obj in sub_codes:
+            sub_asm, labelno = self._qpc_compile(code=qick_obj, regno=regno + nregs, labelno=labelno)
+            sub_codes_asm[key] = sub_asm
+        asm = _sub_keys(_key_re, sub_codes_asm, asm)
 
         # compile the QickExpression
         with QickScope(code=code):
-            # make a copy since we'll be adding new elements
-            for key, qick_obj in code.kvp.copy().items():
-                if isinstance(qick_obj, QickExpression):
-                    pre_asm, exp_asm = self._qpc_compile_exp(exp=qick_obj, regno=regno + nregs)
-                    asm = asm.replace(key + 'pre_asm', pre_asm)
-                    asm = asm.replace(key + 'exp_asm', exp_asm)
+            # collect the expressions first since we'll be adding new elements
+            exps = [(k, v) for k, v in code.kvp.items()
+                if isinstance(v, QickExpression)]
+            exps_asm = {}
+            for key, qick_obj in exps:
+                pre_asm, exp_asm = self._qpc_compile_exp(exp=qick_obj, regno=regno + nregs)
+                exps_asm[key + 'pre_asm'] = pre_asm
+                exps_asm[key + 'exp_asm'] = exp_asm
+        asm = _sub_keys(_exp_key_re, exps_asm, asm)
 
         # compile the rest of the non-code objects
+        # keys are the object keys, values are the compiled assembly code
+        values = {}
         for key, qick_obj in code.kvp.items():
             if isinstance(qick_obj, QickTime) or \
                 isinstance(qick_obj, QickFreq) or \
                 isinstance(qick_obj, QickPhase):
-                asm = asm.replace(key, str(qick_obj.clocks()))
+                values[key] = str(qick_obj.clocks())
             elif isinstance(qick_obj, QickInt):
-                asm = asm.replace(key,str(qick_obj.val))
+                values[key] = str(qick_obj.val)
             elif isinstance(qick_obj, QickLabel):
-                asm = asm.replace(key, f'{qick_obj.prefix}_{labelno}')
+                values[key] = f'{qick_obj.prefix}_{labelno}'
                 labelno += 1
             elif isinstance(qick_obj, QickReg):
                 if qick_obj.reg is None:
-                    asm = asm.replace(key, f'r{regno}')
+                    values[key] = f'r{regno}'
                     regno += 1
                 else:
-                    asm = asm.replace(key, qick_obj.reg)
+                    values[key] = qick_obj.reg
+        # substitute them all in a single pass over the assembly code
+        asm = _sub_keys(_key_re, values, asm)
 
         # substitute port names for numbers
-        for port_type in self.iomap.mappings:
-            for port_name, port in self.iomap.mappings[port_type].items():
-                # port name is a string, e.g. "PMOD0_0"
-                # port is one of the namedtuple types from io.py
-                asm = asm.replace(f'*{port_name}*', str(port.port))
+        if self._port_re is not None:
+            asm = _sub_keys(self._port_re, self._port_nums, asm)
 
-        # add name footer
+        # add name header and footer, joined in one step so the compiled
+        # assembly code is only copied once
         if code.name is not None:
-            asm += f'// ---------------\n// end {code.name}\n// ---------------\n'
+            asm = ''.join((
+                _comment_rule, f'// {code.name}\n', _comment_rule,
+                asm,
+                _comment_rule, f'// end {code.name}\n', _comment_rule,
+            ))
 
         return asm, labelno
 
@@ -306,21 +431,21 @@ class QPC(QickProgramV2):
             code = code.qick_copy()
 
             # add a NOP to the beginning of the program
-            wrapper_code.asm += 'NOP\n'
+            wrapper_code.append_asm('NOP\n')
             # add a short inc_ref to the beginning of the program
-            wrapper_code.asm += f'TIME inc_ref #{QickTime(100e-6)}\n'
+            wrapper_code.append_asm(f'TIME inc_ref #{QickTime(100e-6)}\n')
 
             # wrap the code
-            wrapper_code.asm += str(code)
+            wrapper_code.append_asm(str(code))
 
             if flag:
                 # wait until the program is finished
-                wrapper_code.asm += 'WAIT time @0\n'
+                wrapper_code.append_asm('WAIT time @0\n')
                 # set a flag to indicate the program finished
-                wrapper_code.asm += f'DMEM_WR [&{self.prog_done_flag_dmem_addr}] imm #1\n'
+                wrapper_code.append_asm(f'DMEM_WR [&{self.prog_done_flag_dmem_addr}] imm #1\n')
 
             # add an infinite loop to the end of the program
-            wrapper_code.asm += 'JUMP HERE\n'
+            wrapper_code.append_asm('JUMP HERE\n')
 
             # compile!
             asm, _ = self._qpc_compile(
@@ -407,10 +532,10 @@ class QPC(QickProgramV2):
                 off_code.rf_pulse(ch=p, time=0, length=1e-6, amp=0, freq=100e6, phase=0)
 
             # disable all DPORTs
-            off_code.asm += '// write 0 into all DPORTs\n'
-            off_code.asm += 'REG_WR r0 imm #0\n'
+            off_code.append_asm('// write 0 into all DPORTs\n')
+            off_code.append_asm('REG_WR r0 imm #0\n')
             for port in self.iomap.data_ports():
-                off_code.asm += f'DPORT_WR p{port} reg r0\n'
+                off_code.append_asm(f'DPORT_WR p{port} reg r0\n')
 
         return off_code
 
@@ -9,6 +9,9 @@ from qpc.type import QickCode
 
 class QickLoop(QickCode):
     """Repeat a code block."""
+    __slots__ = ('loops', 'inc_ref', 'loop_reg', 'nloops_reg',
+        'loop_start_label', 'loop_end_label')
+
     def __init__(
         self,
         code: QickCode,
@@ -62,24 +65,27 @@ class QickLoop(QickCode):
                 self.loop_reg.assign(QickInt(0))
                 self.nloops_reg.assign(QickInt(loops))
 
-            self.asm += f'{self.loop_start_label}:\n'
+            self.append_asm(f'{self.loop_start_label}:\n')
 
             if self.loops is not None:
-                self.asm += f'TEST -op({self.loop_reg} - {self.nloops_reg})\n'
-                self.asm += f'JUMP {self.loop_end_label} -if(NS)\n'
+                self.append_asm(f'TEST -op({self.loop_reg} - {self.nloops_reg})\n')
+                self.append_asm(f'JUMP {self.loop_end_label} -if(NS)\n')
 
-            self.asm += str(code)
+            self.append_asm(str(code))
 
             if self.loops is not None:
                 self.loop_reg.assign(self.loop_reg + QickInt(1))
 
-            self.asm += f'JUMP {self.loop_start_label}\n'
+            self.append_asm(f'JUMP {self.loop_start_label}\n')
 
             if self.loops is not None:
-                self.asm += f'{self.loop_end_label}:\n'
+                self.append_asm(f'{self.loop_end_label}:\n')
 
 class QickSweep(QickCode):
     """While loop that sweeps the value stored in a register."""
+    __slots__ = ('inc_ref', 'sweep_start_label', 'sweep_end_label', 'sweep_reg',
+        'sweep_stop_reg', 'sweep_step_reg')
+
     def __init__(
         self,
         code: QickCode,
@@ -122,26 +128,26 @@ class QickSweep(QickCode):
             self.sweep_reg = reg
 
             # the current value of the sweep
-            self.asm += '// sweep start\n'
-            self.asm += self.sweep_reg._assign(self.sweep_reg.start)
+            self.append_asm('// sweep start\n')
+            self.append_asm(self.sweep_reg._assign(self.sweep_reg.start))
             # the max value of the sweep
-            self.asm += '// sweep stop\n'
+            self.append_asm('// sweep stop\n')
             self.sweep_stop_reg = QickReg()
-            self.asm += self.sweep_stop_reg._assign(self.sweep_reg.stop)
+            self.append_asm(self.sweep_stop_reg._assign(self.sweep_reg.stop))
             # the step size of the sweep
-            self.asm += '// sweep step\n'
+            self.append_asm('// sweep step\n')
             self.sweep_step_reg = QickReg()
-            self.asm += self.sweep_step_reg._assign(self.sweep_reg.step)
+            self.append_asm(self.sweep_step_reg._assign(self.sweep_reg.step))
 
             # exit the loop of sweep_reg > sweep_stop_reg
-            self.asm += f'{self.sweep_start_label}:\n'
-            self.asm += f'TEST -op({self.sweep_reg} - {self.sweep_stop_reg})\n'
-            self.asm += f'JUMP {self.sweep_end_label} -if(NS)\n'
+            self.append_asm(f'{self.sweep_start_label}:\n')
+            self.append_asm(f'TEST -op({self.sweep_reg} - {self.sweep_stop_reg})\n')
+            self.append_asm(f'JUMP {self.sweep_end_label} -if(NS)\n')
 
             # insert the code
-            self.asm += str(code)
+            self.append_asm(str(code))
 
             # increment sweep_reg by sweep_reg.step
-            self.asm += self.sweep_reg._assign(self.sweep_reg + self.sweep_step_reg)
-            self.asm += f'JUMP {self.sweep_start_label}\n'
-            self.asm += f'{self.sweep_end_label}:\n'
+            self.append_asm(self.sweep_reg._assign(self.sweep_reg + self.sweep_step_reg))
+            self.append_asm(f'JUMP {self.sweep_start_label}\n')
+            self.append_asm(f'{self.sweep_end_label}:\n')
@@ -9,6 +9,8 @@ from qpc.type import QickType, QickVarType, QickFreq, QickPhase, QickTime
 from qpc.type import QickReg, QickCode
 
 class Delay(QickCode):
+    __slots__ = ()
+
     def __init__(self, length: QickType, *args, **kwargs):
         """A delay.
 
@@ -21,6 +23,8 @@ class Delay(QickCode):
         super().__init__(*args, length=length, **kwargs)
 
 class TrigConst(QickCode):
+    __slots__ = ()
+
     def __init__(
         self,
         ch: Union[QickIODevice, QickIO, int],
@@ -43,6 +47,8 @@ class TrigConst(QickCode):
         self.trig(ch=ch, state=state, time=0)
 
 class TrigPulse(QickCode):
+    __slots__ = ()
+
     def __init__(
         self,
         ch: Union[QickIODevice, QickIO, int],
@@ -73,6 +79,8 @@ class TrigPulse(QickCode):
             self.trig(ch=ch, state=False, time=length)
 
 class RFPulse(QickCode):
+    __slots__ = ()
+
     def __init__(
         self,
         ch: Union[QickIODevice, QickIO, int],
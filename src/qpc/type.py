@@ -5,11 +5,13 @@ Author: Jacob Feder
 Date: 2024-08-16
 """
 from __future__ import annotations
-from abc import ABC, abstractmethod
 from copy import deepcopy
-from inspect import isclass
+from functools import lru_cache
+from itertools import count
 from numbers import Number
-from types import MethodType
+import re
+import sys
+import threading
 from typing import Optional, Union, Type
 
 import numpy as np
@@ -18,15 +20,59 @@ import sympy
 
 from qpc.io import QickIO, QickIODevice
 
+class _QickScopeStack(threading.local):
+    """Per-thread stack of the active QickScope, so that separate threads
+    can build and compile programs independently."""
+    def __init__(self):
+        self.stack = []
+        # top of the stack, or None if the stack is empty
+        self.current = None
+
 # keep track of current scope of the qick code being created
-qpc_scope = []
+qpc_scope = _QickScopeStack()
 
 # unique id counter for qpc objects
-qpc_id = 0
+qpc_id = count()
+
+# matches the keys of QickObject in the assembly code, e.g. *12345*
+_key_re = re.compile(r'\*\d+\*')
+
+# attribute types that QickObject.__deepcopy__() shares instead of copying,
+# QickType is added after its definition
+_atomic_types = frozenset((type(None), bool, int, float, complex, str, type))
+
+# signal generator config register fields
+_sig_gen_outsel = {'product': 0, 'dds': 1, 'input': 2, 'zero': 3}
+_sig_gen_mode = {'oneshot': 0, 'periodic': 1}
+_sig_gen_stdysel = {'last': 0, 'zero': 1}
+
+@lru_cache(maxsize=None)
+def _sig_gen_conf_val(outsel: str, mode: str, stdysel: str, phrst: bool) -> int:
+    """Return the signal generator config register value. See
+    QickCode.sig_gen_conf()."""
+    outsel_reg = _sig_gen_outsel[outsel]
+    mode_reg = _sig_gen_mode[mode]
+    stdysel_reg = _sig_gen_stdysel[stdysel]
+    return int(phrst) * 0b10000 + stdysel_reg * 0b01000 + mode_reg * 0b00100 + outsel_reg
+
+@lru_cache(maxsize=None)
+def _slot_names(cls: type) -> tuple:
+    """Return the names of all __slots__ declared by cls and its bases."""
+    names = []
+    for base in cls.__mro__:
+        slots = base.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name not in ('__dict__', '__weakref__'):
+                names.append(name)
+    return tuple(names)
 
 class QickScope:
     """QPC program scope. QPC objects defined within this scope will be
     associated with the code given in the constructor."""
+    __slots__ = ('code',)
+
     def __init__(
             self,
             code: QickCode,
@@ -40,26 +86,32 @@ class QickScope:
         self.code = code
 
     def __enter__(self):
-        if len(qpc_scope):
+        parent = qpc_scope.current
+        if parent is not None:
+            parent_code = parent.code
             # inherit soc from parent scope
-            parent_soc = qpc_scope[-1].code.soc
-            this_soc = self.code.soc
-            if this_soc is None:
-                self.code.soc = parent_soc
+            if self.code.soc is None:
+                self.code.soc = parent_code.soc
             # inherit iomap from parent scope
-            parent_iomap = qpc_scope[-1].code.iomap
-            this_iomap = self.code.iomap
-            if this_iomap is None:
-                self.code.iomap = parent_iomap
+            if self.code.iomap is None:
+                self.code.iomap = parent_code.iomap
 
-        qpc_scope.append(self)
+        qpc_scope.stack.append(self)
+        qpc_scope.current = self
         return self
 
     def __exit__(self, *args):
-        qpc_scope.pop()
+        stack = qpc_scope.stack
+        stack.pop()
+        if stack:
+            qpc_scope.current = stack[-1]
+        else:
+            qpc_scope.current = None
 
 class QickObject:
     """An object to be used with the QPC compiler."""
+    __slots__ = ('id', 'scope', 'scope_required', '_cached_key')
+
     def __init__(self, scope_required: bool = True):
         """
 
@@ -73,20 +125,60 @@ class QickObject:
 
     def _alloc_qpc_id(self) -> int:
         """Allocate a unique id number."""
-        global qpc_id
-        self.id = qpc_id
-        qpc_id += 1
+        self._set_id(next(qpc_id))
+
+    def _set_id(self, id_num: int):
+        """Set the id number of this object.
+
+        Args:
+            id_num: New id number.
+
+        """
+        self.id = id_num
+        # the key is needed every time this object is formatted into assembly
+        # code, so build it once here
+        self._cached_key = sys.intern(f'*{id_num}*')
 
     def _connect_scope(self):
         """Connect object to the local scope."""
-        if len(qpc_scope):
-            self.scope = qpc_scope[-1]
+        scope = qpc_scope.current
+        if scope is not None:
+            self.scope = scope
         else:
             if self.scope_required:
                 raise RuntimeError('Cannot create a QickObject outside of a QickScope.')
             else:
                 self.scope = None
 
+    def __deepcopy__(self, memo: Dict) -> QickObject:
+        """Copy the attributes of this object directly instead of going
+        through the generic __reduce_ex__ based deepcopy.
+
+        Args:
+            memo: deepcopy memo dictionary.
+
+        """
+        cls = type(self)
+        clone = cls.__new__(cls)
+        memo[id(self)] = clone
+        for name in _slot_names(cls):
+            try:
+                val = getattr(self, name)
+            except AttributeError:
+                # slot was never assigned
+                continue
+            if type(val) not in _atomic_types:
+                val = deepcopy(val, memo)
+            setattr(clone, name, val)
+        if hasattr(self, '__dict__'):
+            clone_dict = clone.__dict__
+            for name, val in self.__dict__.items():
+                if type(val) in _atomic_types:
+                    clone_dict[name] = val
+                else:
+                    clone_dict[name] = deepcopy(val, memo)
+        return clone
+
     def _qick_copy(self, scopes: Dict, new_ids: list, new_ids_lut: Dict):
         """Implements deepcopy-like behavior.
 
@@ -115,7 +207,7 @@ class QickObject:
             if key in new_ids_lut:
                 # this is a different copy of an object that has already been
                 # assigned a new id
-                self.id = new_ids_lut[key].id
+                self._set_id(new_ids_lut[key].id)
             else:
                 # this key has not been previously processed
                 # the object was created inside the scope, so it needs a new id
@@ -129,10 +221,16 @@ class QickObject:
             pass
 
     def __str__(self) -> str:
-        return self.key()
+        # same as key(), inlined since this runs for every object formatted
+        # into assembly code
+        key = self._cached_key
+        scope = self.scope
+        if scope is not None:
+            scope.code.kvp.setdefault(key, self)
+        return key
 
     def _key(self) -> str:
-        return f'*{self.id}*'
+        return self._cached_key
 
     def key(self, subid: Optional[str] = None) -> str:
         """Get the key associated with this object, or create a new one
@@ -145,11 +243,12 @@ class QickObject:
             A unique string representing this object.
 
         """
-        key = self._key()
+        key = self._cached_key
 
-        if self.scope is not None:
-            if key not in self.scope.code.kvp:
-                self.scope.code.kvp[key] = self
+        scope = self.scope
+        if scope is not None:
+            # register this object unless the key is already registered
+            scope.code.kvp.setdefault(key, self)
 
         if subid is None:
             return key
@@ -158,6 +257,8 @@ class QickObject:
 
 class QickLabel(QickObject):
     """Represents an assembly code label."""
+    __slots__ = ('prefix',)
+
     def __init__(self, prefix: str):
         """
         Args:
@@ -169,6 +270,8 @@ class QickLabel(QickObject):
 
 class QickType:
     """Represents the type for a QickObject."""
+    __slots__ = ('type_class', 'gen_ch', 'ro_ch')
+
     def __init__(
             self,
             type_class: Type,
@@ -187,18 +290,31 @@ class QickType:
         self.gen_ch = gen_ch
         self.ro_ch = ro_ch
 
-class QickBaseType(QickObject, ABC):
+    def same_as(self, other: QickType) -> bool:
+        """Return true if other has the same type class and channels.
+
+        Args:
+            other: QickType to compare to.
+
+        """
+        return self.type_class is other.type_class and \
+            self.gen_ch == other.gen_ch and \
+            self.ro_ch == other.ro_ch
+
+# QickType is never modified after it is created, so copies can share it
+_atomic_types |= {QickType}
+
+class QickBaseType(QickObject):
     """Base class for fundamental types used in the qick firmware."""
+    __slots__ = ()
 
-    @abstractmethod
     def qick_type(self) -> Optional[QickType]:
         """Returns the QickType of this object."""
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
     def typecast(self, other: Union[QickBaseType, Type]):
         """Return self converted into the qick type of other."""
-        pass
+        raise NotImplementedError
 
     def scopecast(self):
         """Change the scope of this object to the current scope."""
@@ -211,15 +327,28 @@ class QickBaseType(QickObject, ABC):
             other: A QickBaseType object.
 
         """
-        if self.qick_type().type_class is None:
+        self_type = self.qick_type()
+        other_type = other.qick_type()
+        if self_type.type_class is None:
             return True
-        elif other.qick_type().type_class is None:
+        elif other_type.type_class is None:
             return False
         else:
-            return self.qick_type().type_class == other.qick_type().type_class
+            return self_type.type_class == other_type.type_class
+
+    def _operands_typecastable(self, other: QickBaseType) -> bool:
+        """Return true if typecast() into the QickType of other would succeed.
+
+        Args:
+            other: A QickBaseType object.
 
-class QickConstType(QickBaseType, ABC):
+        """
+        return self.typecastable(other)
+
+class QickConstType(QickBaseType):
     """Base class for types that have a constant value."""
+    __slots__ = ('val', '_qick_type')
+
     def __init__(
             self,
             val: Number,
@@ -242,12 +371,52 @@ class QickConstType(QickBaseType, ABC):
 
         if not isinstance(val, Number):
             raise TypeError('val must be a number.')
+        self._init_const(val=val, gen_ch=gen_ch, ro_ch=ro_ch)
+
+    def _init_const(
+            self,
+            val: Number,
+            gen_ch: Optional[QickIODevice, QickIO, int] = None,
+            ro_ch: Optional[QickIODevice, QickIO, int] = None,
+        ):
+        """Set up the value and QickType of this object. Shared by __init__()
+        and _from_val().
+
+        Args:
+            val: Value in SI units (s, Hz, etc.).
+            gen_ch: The generator channel associated with this object.
+            ro_ch: The readout channel associated with this object.
+
+        """
         self.val = val
-        self._qick_type = QickType(
-            type_class=self.__class__,
-            gen_ch=gen_ch,
-            ro_ch=ro_ch,
-        )
+        if gen_ch is None and ro_ch is None:
+            self._qick_type = self._no_ch_qick_type
+        else:
+            self._qick_type = QickType(
+                type_class=self.__class__,
+                gen_ch=gen_ch,
+                ro_ch=ro_ch,
+            )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # QickType shared by all instances that have no channels
+        cls._no_ch_qick_type = QickType(type_class=cls)
+
+    @classmethod
+    def _from_val(cls, val: Number) -> QickConstType:
+        """Create a new object with no channels, skipping the argument checks
+        of the constructor. Used for the results of arithmetic on objects that
+        were already checked.
+
+        Args:
+            val: Value in SI units (s, Hz, etc.).
+
+        """
+        obj = cls.__new__(cls)
+        super(QickConstType, obj).__init__()
+        obj._init_const(val=val)
+        return obj
 
     def qick_type(self) -> Optional[QickType]:
         """Returns the QickType of this object."""
@@ -256,10 +425,11 @@ class QickConstType(QickBaseType, ABC):
     def typecast(self, other: QickBaseType) -> QickConstType:
         """Return a copy of self converted into the qick type of other."""
         if self.typecastable(other):
-            return other.qick_type().type_class(
+            other_type = other.qick_type()
+            return other_type.type_class(
                 val=self.val,
-                gen_ch=other.qick_type().gen_ch,
-                ro_ch=other.qick_type().ro_ch
+                gen_ch=other_type.gen_ch,
+                ro_ch=other_type.ro_ch
             )
         else:
             raise TypeError('Cannot cast to type of other because their types '
@@ -318,7 +488,10 @@ class QickConstType(QickBaseType, ABC):
         raise RuntimeError('Tried to get the actual() of an invalid type.')
 
     def __add__(self, other) -> QickConstType:
-        if isinstance(other, QickConstType):
+        if type(other) is type(self):
+            # same type of constant, so no typecasting is needed
+            return type(self)._from_val(self.val + other.val)
+        elif isinstance(other, QickConstType):
             if not self.typecastable(other):
                 raise TypeError('Cannot add these QickConstType because their '
                     'types are incompatible.')
@@ -328,13 +501,19 @@ class QickConstType(QickBaseType, ABC):
         else:
             return NotImplemented
 
-        return self.qick_type().type_class(val=self.val + other_val)
+        return type(self)._from_val(self.val + other_val)
 
     def __radd__(self, other) -> QickConstType:
         return self.__add__(other)
 
     def __sub__(self, other, swap: bool = False) -> QickConstType:
-        if isinstance(other, QickConstType):
+        if type(other) is type(self):
+            # same type of constant, so no typecasting is needed
+            if swap:
+                return type(self)._from_val(other.val - self.val)
+            else:
+                return type(self)._from_val(self.val - other.val)
+        elif isinstance(other, QickConstType):
             if not self.typecastable(other):
                 raise TypeError('Cannot subtract these QickConstType because '
                     'their types are incompatible.')
@@ -345,15 +524,18 @@ class QickConstType(QickBaseType, ABC):
             return NotImplemented
 
         if swap:
-            return self.qick_type().type_class(val=other_val - self.val)
+            return type(self)._from_val(other_val - self.val)
         else:
-            return self.qick_type().type_class(val=self.val - other_val)
+            return type(self)._from_val(self.val - other_val)
 
     def __rsub__(self, other) -> QickConstType:
         return self.__sub__(other, swap=True)
 
     def __mul__(self, other) -> QickConstType:
-        if isinstance(other, QickConstType):
+        if type(other) is type(self):
+            # same type of constant, so no typecasting is needed
+            return type(self)._from_val(self.val * other.val)
+        elif isinstance(other, QickConstType):
             if not self.typecastable(other):
                 raise TypeError('Cannot multiply these QickConstType because '
                     'their types are incompatible.')
@@ -363,7 +545,7 @@ class QickConstType(QickBaseType, ABC):
         else:
             return NotImplemented
 
-        return self.qick_type().type_class(val=self.val * other_val)
+        return type(self)._from_val(self.val * other_val)
 
     def __rmul__(self, other) -> QickConstType:
         return self.__mul__(other)
@@ -378,12 +560,22 @@ class QickConstType(QickBaseType, ABC):
         """
         return self.val
 
+# __init_subclass__ only runs for subclasses
+QickConstType._no_ch_qick_type = QickType(type_class=QickConstType)
+
 class QickInt(QickConstType):
     """Represents an integer."""
-    pass
+    __slots__ = ()
+
+@lru_cache(maxsize=None)
+def _time_classes(a_cls: type, b_cls: type) -> bool:
+    """Return true if both classes are QickTime classes."""
+    return issubclass(a_cls, QickTime) and issubclass(b_cls, QickTime)
 
 class QickTime(QickConstType):
     """Represents a time."""
+    __slots__ = ()
+
     def typecastable(self, other: QickBaseType) -> bool:
         """Return true if self can be typecast into the QickType of other.
 
@@ -391,14 +583,18 @@ class QickTime(QickConstType):
             other: A QickBaseType object.
 
         """
-        if self.qick_type().type_class is None:
+        if type(other) is type(self):
+            return True
+
+        self_type = self.qick_type()
+        other_type = other.qick_type()
+        if self_type.type_class is None:
             return True
-        elif other.qick_type().type_class is None:
+        elif other_type.type_class is None:
             return False
         else:
             # freely convert between other types of QickTimes
-            return issubclass(self.qick_type().type_class, QickTime) and \
-                issubclass(other.qick_type().type_class, QickTime)
+            return _time_classes(self_type.type_class, other_type.type_class)
 
     def _clocks(self, gen_ch: Optional[int], ro_ch: Optional[int]):
         """Convert to an integer number of device clock cycles."""
@@ -419,6 +615,8 @@ class QickTime(QickConstType):
 
 class QickFreq(QickConstType):
     """Represents a frequency."""
+    __slots__ = ()
+
     def _clocks(self, gen_ch: Optional[int], ro_ch: Optional[int]):
         """Convert to an integer number of device clock cycles."""
         if gen_ch is None:
@@ -440,6 +638,8 @@ class QickFreq(QickConstType):
 
 class QickPhase(QickConstType):
     """Represents a phase in degrees."""
+    __slots__ = ()
+
     def _clocks(self, gen_ch: Optional[int], ro_ch: Optional[int]):
         """Convert to an integer number of device clock cycles."""
         if gen_ch is None:
@@ -461,6 +661,11 @@ class QickPhase(QickConstType):
 
 class QickVarType(QickBaseType):
     """Base class for variable types."""
+    __slots__ = ('held_type',)
+    # held type of variables that have not been typecast yet, shared since
+    # QickType is never modified after it is created
+    _untyped_qick_type = QickType(type_class=None)
+
     def __init__(self, *args, **kwargs):
         """
 
@@ -470,7 +675,7 @@ class QickVarType(QickBaseType):
 
         """
         super().__init__(*args, **kwargs)
-        self.held_type: Optional[QickType] = QickType(type_class=None)
+        self.held_type: Optional[QickType] = self._untyped_qick_type
 
     def qick_type(self) -> Optional[QickType]:
         return self.held_type
@@ -480,6 +685,14 @@ class QickVarType(QickBaseType):
             raise TypeError('Cannot add these QickVarType because their '
                 'types are not compatible.')
 
+        if isinstance(other, QickConstType) and other.val == 0:
+            # adding zero, which simplify() would remove anyway, so only the
+            # typecasting that QickExpression would perform remains
+            if other.typecastable(self):
+                return self
+            else:
+                return self.typecast(other)
+
         return QickExpression(left=self, operator='+', right=other).simplify()
 
     def __radd__(self, other) -> QickExpression:
@@ -508,6 +721,8 @@ class QickVarType(QickBaseType):
 
 class QickReg(QickVarType):
     """Represents a register in the tproc."""
+    __slots__ = ('reg',)
+
     def __init__(
             self,
             *args,
@@ -541,9 +756,11 @@ class QickReg(QickVarType):
             other: A QickBaseType object.
 
         """
-        if self.qick_type().type_class is None:
+        self_type = self.qick_type()
+        other_type = other.qick_type()
+        if self_type.type_class is None:
             return True
-        elif other.qick_type().type_class is None:
+        elif other_type.type_class is None:
             return False
         else:
             # registers require stricter typecasting rules than other objects
@@ -552,9 +769,9 @@ class QickReg(QickVarType):
             # r0 = 5 clock cycles (in units of generator 0)
             # r1 = 10 clock cycles (in units of generator 1)
             # r2 = r0 + r1 (this would be an invalid result!)
-            return self.qick_type().type_class == other.qick_type().type_class and \
-                self.qick_type().gen_ch == other.qick_type().gen_ch and \
-                self.qick_type().ro_ch == other.qick_type().ro_ch
+            return self_type.type_class == other_type.type_class and \
+                self_type.gen_ch == other_type.gen_ch and \
+                self_type.ro_ch == other_type.ro_ch
 
     def typecast(self, other: QickBaseType) -> QickReg:
         """Convert self into the QickType of other."""
@@ -578,7 +795,7 @@ class QickReg(QickVarType):
             value: The value to assign.
 
         """
-        self.scope.code.asm += self._assign(value=value)
+        self.scope.code.append_asm(self._assign(value=value))
 
     # TODO use this implementation once multiplication / ARITH is implemented
     # def _to_sympy(self, regs: Dict):
@@ -611,6 +828,8 @@ class QickReg(QickVarType):
 
 class QickSweptReg(QickReg):
     """Represents the arguments to a swept variable."""
+    __slots__ = ('start', 'stop', 'step')
+
     def __init__(
             self,
             start: Union[QickConstType, QickVarType],
@@ -656,6 +875,8 @@ class QickSweptReg(QickReg):
 
 class QickExpression(QickVarType):
     """Represents a mathematical expression containing QickBaseType."""
+    __slots__ = ('left', 'right', 'operator')
+
     def __init__(
             self,
             left: QickBaseType,
@@ -676,19 +897,22 @@ class QickExpression(QickVarType):
         super().__init__(*args, **kwargs)
 
         # make sure left and right have the same qick type
-        try:
+        left_type = left.qick_type()
+        if right.qick_type().same_as(left_type):
+            pass
+        elif right._operands_typecastable(left):
             right = right.typecast(left)
-        except TypeError:
-            try:
-                left = left.typecast(right)
-            except TypeError:
-                raise TypeError('Could not create new QickExpression because '
-                    'left and right could not be typecast to the same type.')
+        elif left._operands_typecastable(right):
+            left = left.typecast(right)
+            left_type = left.qick_type()
+        else:
+            raise TypeError('Could not create new QickExpression because '
+                'left and right could not be typecast to the same type.')
 
         self.left = left
         self.right = right
         self.operator = operator
-        self.held_type: QickType = left.qick_type()
+        self.held_type: QickType = left_type
 
     def __str__(self):
         raise ValueError('QickExpression cannot be converted into a string '
@@ -726,22 +950,42 @@ class QickExpression(QickVarType):
         if isinstance(self.right, QickBaseType):
             self.right.scopecast()
 
+    def _operands_typecastable(self, other: QickBaseType) -> bool:
+        """Return true if typecast() into the QickType of other would succeed,
+        i.e. if both operands can be typecast into it.
+
+        Args:
+            other: A QickBaseType object.
+
+        """
+        if isinstance(self.left, QickBaseType) and \
+                not self.left._operands_typecastable(other):
+            return False
+        if isinstance(self.right, QickBaseType) and \
+                not self.right._operands_typecastable(other):
+            return False
+        return True
+
     def typecast(self, other: Union[QickBaseType, Type]) -> QickExpression:
         """Return self converted into the type of other."""
-        try:
-            if isinstance(self.left, QickBaseType):
-                left = self.left.typecast(other)
-            else:
-                left = self.left
-
-            if isinstance(self.right, QickBaseType):
-                right = self.right.typecast(other)
-            else:
-                right = self.right
+        if self.held_type.same_as(other.qick_type()):
+            # the operands already have the type of other
+            return self
 
-        except TypeError as err:
+        if not self._operands_typecastable(other):
             raise TypeError('QickExpression failed to typecast into new '
-                'type.') from err
+                'type.')
+
+        if isinstance(self.left, QickBaseType):
+            left = self.left.typecast(other)
+        else:
+            left = self.left
+
+        if isinstance(self.right, QickBaseType):
+            right = self.right.typecast(other)
+        else:
+            right = self.right
+
         return type(self)(left=left, operator=self.operator, right=right)
 
     def _to_sympy(self, regs: Dict):
@@ -835,12 +1079,10 @@ class QickExpression(QickVarType):
         # for later reconstructin of the expression
         regs = {}
         
-        # generate a sympy expression constructed from this expression
+        # generate a sympy expression constructed from this expression, sympy
+        # combines the constant terms of nested sums as the expression is built
         sym_exp = self._to_sympy(regs=regs)
 
-        # simplify the expression
-        sym_exp.simplify()
-
         # convert the sympy expression back into a QickExpression
         return QickExpression._from_sympy(
             exp=sym_exp,
@@ -850,6 +1092,8 @@ class QickExpression(QickVarType):
 
 class QickAssignment(QickObject):
     """Represents assignment of a value containing QickBaseType to a register."""
+    __slots__ = ('reg', 'rhs')
+
     def __init__(
             self,
             reg: QickReg,
@@ -914,6 +1158,9 @@ class QickCode(QickObject):
     code is uploaded to the board.
 
     """
+    __slots__ = ('_asm_parts', 'kvp', '_io_cache', '_named_regs', '_zero_time',
+        'name', 'soc', 'iomap', 'length', 'offset')
+
     def __init__(
             self,
             offset: Optional[Number, QickBaseType] = None,
@@ -938,10 +1185,18 @@ class QickCode(QickObject):
 
         """
         super().__init__(*args, scope_required=False, **kwargs)
-        # assembly code string
-        self.asm = ''
+        # assembly code, stored as a list of strings which are only joined
+        # when the asm property is read to avoid quadratic string appends
+        self._asm_parts = []
         # key-value pairs
         self.kvp = {}
+        # deembed_io() results, keys are id(io), values are
+        # (io, io.offset, port, port_offset)
+        self._io_cache = {}
+        # QickReg for the named firmware registers, keys are the register names
+        self._named_regs = {}
+        # zero offset of ports that don't have a QickIO, created on first use
+        self._zero_time = None
 
         self.name = name
         self.soc = soc
@@ -968,6 +1223,29 @@ class QickCode(QickObject):
             else:
                 raise ValueError('offset has an invalid type')
 
+    @property
+    def asm(self) -> str:
+        """Assembly code string."""
+        if len(self._asm_parts) > 1:
+            self._asm_parts = [''.join(self._asm_parts)]
+        if self._asm_parts:
+            return self._asm_parts[0]
+        else:
+            return ''
+
+    @asm.setter
+    def asm(self, asm: str):
+        self._asm_parts = [asm]
+
+    def append_asm(self, asm: str):
+        """Append assembly code to the end of this code block.
+
+        Args:
+            asm: Assembly code string.
+
+        """
+        self._asm_parts.append(asm)
+
     def merge_kvp(self, kvp: Dict):
         """Merge the given key-value pairs into this code block's key-value
         pairs.
@@ -976,20 +1254,22 @@ class QickCode(QickObject):
             kvp: Key-value pair dictionary.
 
         """
-        for k, v in kvp.items():
-            if k in self.kvp and v != self.kvp[k]:
+        self_kvp = self.kvp
+        # keys are unique per object, so a shared key must hold the same object
+        for k in self_kvp.keys() & kvp.keys():
+            if kvp[k] is not self_kvp[k]:
                 raise RuntimeError('Internal error merging key-value '
                     'pairs. Key already exists with different value.')
-            else:
-                self.kvp[k] = v
-                v.scope.code = self
+        self_kvp.update(kvp)
+        for v in kvp.values():
+            v.scope.code = self
 
     def inc_ref(self):
         """Increment the reference by the length of this code block."""
         with QickScope(code=self):
             ref_reg = QickReg()
             ref_reg.assign(self.length)
-            self.asm += f'TIME inc_ref {ref_reg}\n'
+            self.append_asm(f'TIME inc_ref {ref_reg}\n')
             # reset the length
             self.length = QickTime(0)
 
@@ -1004,21 +1284,65 @@ class QickCode(QickObject):
                 to by old_key.
 
         """
-        # get the new key
-        new_key = new_obj._key()
-        # replace all instances of the old key with the new key in the assembly code
-        self.asm = self.asm.replace(old_key, new_key)
-
-        if old_key in self.kvp:
-            # delete the old key
-            del self.kvp[old_key]
-            # replace the old key with the new
-            self.kvp[new_key] = new_obj
-
-        # recursively fix other instances of old_key
+        self.update_keys({old_key: new_obj})
+
+    def update_keys(self, new_objs: Dict):
+        """Update the given keys in the assembly code and key-value pair
+        dictionary of this QickCode, and then recursively for all QickCode
+        within this QickCode.
+
+        Args:
+            new_objs: Keys are the keys that need to be updated, values are the
+                objects that will take the place of the objects pointed to by
+                those keys.
+
+        """
+        new_keys = {old_key: new_obj._key() for old_key, new_obj in new_objs.items()}
+        self._update_keys(new_objs=new_objs, new_keys=new_keys)
+
+    def _update_keys(self, new_objs: Dict, new_keys: Dict):
+        """Implements update_keys().
+
+        Args:
+            new_objs: Keys are the keys that need to be updated, values are the
+                objects that will take the place of the objects pointed to by
+                those keys.
+            new_keys: Keys are the keys that need to be updated, values are the
+                keys of the corresponding objects in new_objs.
+
+        """
+        # replace all instances of the old keys with the new keys in a single
+        # pass over the assembly code, skipping code that contains no keys
+        asm = self.asm
+        if '*' in asm:
+            self.asm = _key_re.sub(
+                lambda m: new_keys.get(m.group(0), m.group(0)),
+                asm
+            )
+
+        for old_key, new_obj in new_objs.items():
+            if old_key in self.kvp:
+                # delete the old key
+                del self.kvp[old_key]
+                # replace the old key with the new
+                self.kvp[new_keys[old_key]] = new_obj
+
+        # recursively fix other instances of the old keys
         for qick_obj in self.kvp.values():
             if isinstance(qick_obj, QickCode):
-                qick_obj.update_key(old_key=old_key, new_obj=new_obj)
+                qick_obj._update_keys(new_objs=new_objs, new_keys=new_keys)
+
+    def __deepcopy__(self, memo: Dict) -> QickCode:
+        """Copy this code block, giving the copy an empty deembed_io() cache.
+
+        Args:
+            memo: deepcopy memo dictionary.
+
+        """
+        # the cache is keyed by id() of the original QickIO objects, so a
+        # copy of it could never hit
+        memo[id(self._io_cache)] = {}
+        return super().__deepcopy__(memo)
 
     def _qick_copy(self, scopes: Dict, new_ids: list, new_ids_lut: Dict):
         """Implements deepcopy-like behavior.
@@ -1043,8 +1367,17 @@ class QickCode(QickObject):
         """Implements deepcopy-like behavior. Replace all qpc id's with new
         id's, unless the object is from outside the scope."""
 
-        # copy the object
-        new_code = deepcopy(self)
+        # copy the object - the soc and iomap describe the hardware rather
+        # than the program, so share them instead of copying them
+        memo = {id(self.soc): self.soc, id(self.iomap): self.iomap}
+        # objects belonging to the enclosing code blocks are outside the scope
+        # of what's being copied and retain their ids, so share those code
+        # blocks instead of copying everything that they contain
+        scope = self.scope
+        while scope is not None and id(scope.code) not in memo:
+            memo[id(scope.code)] = scope.code
+            scope = scope.code.scope
+        new_code = deepcopy(self, memo)
 
         # put the new code in the current scope
         new_code._connect_scope()
@@ -1058,11 +1391,30 @@ class QickCode(QickObject):
         new_code._qick_copy(scopes=scopes, new_ids=new_ids, new_ids_lut=new_ids_lut)
 
         # for the objects that acquired new keys, update them in the kvp and asm
-        for old_key, new_obj in new_ids_lut.items():
-            new_code.update_key(old_key=old_key, new_obj=new_obj)
+        new_code.update_keys(new_ids_lut)
 
         return new_code
 
+    def _named_reg(self, reg: str) -> QickReg:
+        """Return the QickReg for a named firmware register. A single QickReg
+        is shared by all assignments to that register in this code block. This
+        must be called from within the scope of this code block.
+
+        Args:
+            reg: Firmware register name, e.g. 'out_usr_time'.
+
+        """
+        named_reg = self._named_regs.get(reg)
+        if named_reg is None:
+            named_reg = QickReg(reg=reg)
+            self._named_regs[reg] = named_reg
+        else:
+            # each assignment may store a different type in the register, the
+            # assignments that were already made only read their rhs and never
+            # the held_type of the register, so resetting it doesn't affect them
+            named_reg.held_type = QickVarType._untyped_qick_type
+        return named_reg
+
     def deembed_io(self, io: Union[QickIODevice, QickIO, int]) -> Tuple:
         """Calculate the final offset relevant to the provided IO.
 
@@ -1074,11 +1426,20 @@ class QickCode(QickObject):
             number and the offset is the total offset of the port.
 
         """
+        # check the cache before any type checks, only QickIO are cached
+        cached = self._io_cache.get(id(io))
+        if cached is not None and cached[0] is io and cached[1] == io.offset:
+            # this io was already deembedded and its offset hasn't changed
+            return cached[2], cached[3]
+
         if isinstance(io, QickIO):
             port_offset = QickTime(io.offset)
             port = io.key()
+            self._io_cache[id(io)] = (io, io.offset, port, port_offset)
         elif isinstance(io, int):
-            port_offset = QickTime(0)
+            if self._zero_time is None:
+                self._zero_time = QickTime(0)
+            port_offset = self._zero_time
             port = io
         else:
             raise ValueError('io has invalid type.')
@@ -1103,19 +1464,19 @@ class QickCode(QickObject):
         """
         with QickScope(code=self):
             port, port_offset = self.deembed_io(ch)
-            self.asm += f'// setting trigger port {port} to {state}\n'
+            self.append_asm(f'// setting trigger port {port} to {state}\n')
             if time is not None:
                 if isinstance(time, Number):
                     time = QickTime(time)
                 # set the play time of the trig
-                out_usr_time = QickReg(reg='out_usr_time')
+                out_usr_time = self._named_reg('out_usr_time')
                 out_usr_time.assign(self.offset + port_offset + time)
 
             # set the trig
             if state:
-                self.asm += f'TRIG set p{port}\n'
+                self.append_asm(f'TRIG set p{port}\n')
             else:
-                self.asm += f'TRIG clr p{port}\n'
+                self.append_asm(f'TRIG clr p{port}\n')
 
     def sig_gen_conf(
             self,
@@ -1141,16 +1502,7 @@ class QickCode(QickObject):
                 free-running DDS counter.
 
         """
-        outsel_reg = {'product': 0, 'dds': 1, 'input': 2, 'zero': 3}[outsel]
-        mode_reg = {'oneshot': 0, 'periodic': 1}[mode]
-        stdysel_reg = {'last': 0, 'zero': 1}[stdysel]
-        if phrst:
-            phrst = 1
-        else:
-            phrst = 0
-
-        mc = phrst * 0b10000 + stdysel_reg * 0b01000 + mode_reg * 0b00100 + outsel_reg
-        return QickInt(mc)
+        return QickInt(_sig_gen_conf_val(outsel, mode, stdysel, bool(phrst)))
 
     def rf_pulse(
             self,
@@ -1186,13 +1538,13 @@ class QickCode(QickObject):
         with QickScope(code=self):
             port, port_offset = self.deembed_io(ch)
 
-            self.asm += f'// pulsing RF port {port}\n'
+            self.append_asm(f'// pulsing RF port {port}\n')
 
             if time is not None:
                 if isinstance(time, Number):
                     time = QickTime(time)
                 # set the play time of the pulse
-                out_usr_time = QickReg(reg='out_usr_time')
+                out_usr_time = self._named_reg('out_usr_time')
                 out_usr_time.assign(self.offset + port_offset + time)
 
             if length is not None:
@@ -1203,14 +1555,14 @@ class QickCode(QickObject):
                         # set the gen_ch if it wasn't set yet
                         length.gen_ch = ch
                 # set the length of the pulse
-                w_length = QickReg(reg='w_length')
+                w_length = self._named_reg('w_length')
                 w_length.assign(length)
 
             if amp is not None:
                 if isinstance(amp, int):
                     amp = QickInt(amp)
                 # set the amplitude of the pulse
-                w_gain = QickReg(reg='w_gain')
+                w_gain = self._named_reg('w_gain')
                 w_gain.assign(amp)
 
             if freq is not None:
@@ -1220,7 +1572,7 @@ class QickCode(QickObject):
                     if freq.gen_ch is None:
                         freq.gen_ch = ch
                 # set the frequency of the pulse
-                w_freq = QickReg(reg='w_freq')
+                w_freq = self._named_reg('w_freq')
                 w_freq.assign(freq)
 
             if phase is not None:
@@ -1230,14 +1582,14 @@ class QickCode(QickObject):
                     if phase.gen_ch is None:
                         phase.gen_ch = ch
                 # set the phase of the pulse
-                w_phase = QickReg(reg='w_phase')
+                w_phase = self._named_reg('w_phase')
                 w_phase.assign(phase)
 
             # set the configuration settings of the pulse
-            w_conf = QickReg(reg='w_conf')
+            w_conf = self._named_reg('w_conf')
             w_conf.assign(self.sig_gen_conf(**conf))
 
-            self.asm += f'WPORT_WR p{port} r_wave\n'
+            self.append_asm(f'WPORT_WR p{port} r_wave\n')
 
     def epoch_offset(self, offset: QickBaseType):
         """Find all out_usr_time assignments and offset them.
@@ -1246,7 +1598,10 @@ class QickCode(QickObject):
             offset: The amount to add to each out_usr_time.
 
         """
-        for old_key, qick_obj in self.kvp.copy().items():
+        # collect the objects first since the loop adds to kvp
+        to_offset = [v for v in self.kvp.values()
+            if isinstance(v, (QickCode, QickAssignment))]
+        for qick_obj in to_offset:
             if isinstance(qick_obj, QickCode):
                 qick_obj.epoch_offset(offset)
             elif isinstance(qick_obj, QickAssignment) and qick_obj.reg.reg == 'out_usr_time':
@@ -1269,7 +1624,7 @@ class QickCode(QickObject):
             code.epoch_offset(offset=self.length)
 
             self.length += code.length
-            self.asm += str(code)
+            self.append_asm(str(code))
 
         if self.name is None and code.name is not None:
             self.name = code.name
@@ -1299,7 +1654,8 @@ class QickCode(QickObject):
                     self.length = code.length
                     self.length.scopecast()
 
-            self.asm += code.asm
+            # take over the code's buffered assembly without joining it first
+            self._asm_parts.extend(code._asm_parts)
             self.merge_kvp(code.kvp)
 
         if self.name is None and code.name is not None:
@@ -1307,6 +1663,36 @@ class QickCode(QickObject):
         elif self.name is not None and code.name is not None:
             self.name = f'({self.name} | {code.name})'
 
+    @staticmethod
+    def concat(*codes: QickCode) -> QickCode:
+        """Return a new code block that runs the given code blocks
+        sequentially. Unlike chaining +, each code block is only copied once.
+
+        Args:
+            codes: Code blocks to run in order.
+
+        """
+        new_block = QickCode()
+        for code in codes:
+            new_block.add(code)
+
+        return new_block
+
+    @staticmethod
+    def parallel_all(*codes: QickCode) -> QickCode:
+        """Return a new code block that runs the given code blocks in
+        parallel. Unlike chaining |, each code block is only copied once.
+
+        Args:
+            codes: Code blocks to run in parallel.
+
+        """
+        new_block = QickCode()
+        for code in codes:
+            new_block.parallel(code)
+
+        return new_block
+
     def __add__(self, code: QickCode):
         if not isinstance(code, QickCode):
             return NotImplemented